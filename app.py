@@ -1,21 +1,61 @@
 from __future__ import annotations
-from flask import Flask, render_template, request, redirect, url_for, make_response, jsonify, abort
-from dataclasses import dataclass, field, asdict
-from typing import Dict, List, Optional, Tuple
-import json
+from flask import Flask, Response, render_template, request, redirect, url_for, make_response, jsonify, abort
+from flask.json.provider import JSONProvider
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
 import os
-import uuid
 import time
 import re
+import threading
+import atexit
+import functools
+import hashlib
+import itertools
+import tempfile
+import weakref
+
+import orjson
 
 # -----------------------------
 # Models
 # -----------------------------
 
+_RE_WS = re.compile(r"\s+")
+_RE_BAD = re.compile(r"[^a-z0-9\-_.]")
+_RE_DASHES = re.compile(r"-+")
+
+
+@functools.lru_cache(maxsize=4096)
+def slugify(name: str) -> str:
+    s = name.strip().lower()
+    s = _RE_WS.sub("-", s)
+    s = _RE_BAD.sub("", s)
+    s = _RE_DASHES.sub("-", s)
+    return s.strip("-")
+
+
+def extract_headings(content: str) -> List[Tuple[str, str]]:
+    # (heading, lowercased heading) pairs so search never re-lowers them.
+    # splitlines() also breaks on \r and the other line boundaries a
+    # multiline regex would miss.
+    headings = (line.lstrip("#").strip() for line in content.splitlines() if line.startswith("#"))
+    return [(h, h.lower()) for h in headings if h]
+
+
 def gen_id() -> str:
-    return uuid.uuid4().hex[:8]
+    return os.urandom(4).hex()
+
 
-@dataclass
+def gen_ids(n: int) -> List[str]:
+    # same 8-hex-char ids as gen_id, drawn with one urandom call
+    raw = os.urandom(4 * n).hex()
+    return [raw[i:i + 8] for i in range(0, 8 * n, 8)]
+
+# Each model's to_dict() lists its persisted fields explicitly: it skips the
+# field introspection and deepcopy of dataclasses.asdict() and leaves out
+# runtime-only fields such as slug. Save paths and API responses share it.
+
+@dataclass(slots=True)
 class Link:
     id: str
     from_type: str  # 'table' | 'column'
@@ -24,13 +64,19 @@ class Link:
     to_id: str
     note: str = ""
 
-@dataclass
+    def to_dict(self) -> dict:
+        return {"id": self.id, "from_type": self.from_type, "from_id": self.from_id, "to_type": self.to_type, "to_id": self.to_id, "note": self.note}
+
+@dataclass(slots=True)
 class ForeignRef:
     table_id: str
     column_id: str
     note: str = ""
 
-@dataclass
+    def to_dict(self) -> dict:
+        return {"table_id": self.table_id, "column_id": self.column_id, "note": self.note}
+
+@dataclass(slots=True)
 class Column:
     id: str
     name: str
@@ -41,15 +87,53 @@ class Column:
     note: str = ""
     foreign_ref: Optional[ForeignRef] = None
     order: int = 0
+    slug: str = field(default="", init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.slug = slugify(self.name)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "datatype": self.datatype,
+            "is_primary": self.is_primary,
+            "is_nullable": self.is_nullable,
+            "default": self.default,
+            "note": self.note,
+            "foreign_ref": self.foreign_ref.to_dict() if self.foreign_ref else None,
+            "order": self.order,
+        }
 
-@dataclass
+@dataclass(slots=True)
 class Table:
     id: str
     name: str
     note: str = ""
     columns: Dict[str, Column] = field(default_factory=dict)
+    slug: str = field(default="", init=False, repr=False, compare=False)
+    # highest column order handed out so far; None until the first scan
+    _max_order: Optional[int] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.slug = slugify(self.name)
+
+    def next_order(self) -> int:
+        # newest column goes to the bottom
+        if self._max_order is None:
+            self._max_order = max((c.order for c in self.columns.values()), default=-1)
+        self._max_order += 1
+        return self._max_order
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "note": self.note,
+            "columns": {c_id: c.to_dict() for c_id, c in self.columns.items()},
+        }
 
-@dataclass
+@dataclass(slots=True)
 class Database:
     id: str
     name: str
@@ -57,12 +141,85 @@ class Database:
     tables: Dict[str, Table] = field(default_factory=dict)
     links: Dict[str, Link] = field(default_factory=dict)
     diagram: dict = field(default_factory=dict)
+    slug: str = field(default="", init=False, repr=False, compare=False)
+    # reverse indexes: column/table id -> ids of links touching it; built on
+    # first use so loading a PIN does not pay for them
+    _links_by_col: Optional[Dict[str, Set[str]]] = field(default=None, init=False, repr=False, compare=False)
+    _links_by_table: Optional[Dict[str, Set[str]]] = field(default=None, init=False, repr=False, compare=False)
+    # bumped by every edit to this database; feeds the /db/<db_id> ETag
+    _version: int = field(default=0, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.slug = slugify(self.name)
+        self._version = next(_DB_VERSIONS)
+
+    def touch(self) -> None:
+        self._version = next(_DB_VERSIONS)
+
+    @property
+    def etag(self) -> str:
+        return f"{self.id}-{_BOOT_ID}-{self._version}"
+
+    def _build_link_index(self) -> None:
+        self._links_by_col = {}
+        self._links_by_table = {}
+        for link in self.links.values():
+            self._index_link(link, True)
+
+    def links_for_column(self, c_id: str) -> Set[str]:
+        if self._links_by_col is None:
+            self._build_link_index()
+        return set(self._links_by_col.get(c_id, ()))
+
+    def links_for_table(self, t_id: str) -> Set[str]:
+        if self._links_by_table is None:
+            self._build_link_index()
+        return set(self._links_by_table.get(t_id, ()))
+
+    def _index_link(self, link: Link, add: bool) -> None:
+        if self._links_by_col is None:
+            return
+        for kind, ref in ((link.from_type, link.from_id), (link.to_type, link.to_id)):
+            index = self._links_by_col if kind == "column" else self._links_by_table if kind == "table" else None
+            if index is None:
+                continue
+            if add:
+                index.setdefault(ref, set()).add(link.id)
+            else:
+                ids = index.get(ref)
+                if ids is not None:
+                    ids.discard(link.id)
+                    if not ids:
+                        del index[ref]
+
+    def add_link(self, link: Link) -> None:
+        old = self.links.get(link.id)
+        if old is not None:
+            self._index_link(old, False)
+        self.links[link.id] = link
+        self._index_link(link, True)
+
+    def remove_link(self, l_id: str) -> Optional[Link]:
+        link = self.links.pop(l_id, None)
+        if link is not None:
+            self._index_link(link, False)
+        return link
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "note": self.note,
+            "tables": {t_id: t.to_dict() for t_id, t in self.tables.items()},
+            "links": {l_id: l.to_dict() for l_id, l in self.links.items()},
+            "diagram": self.diagram,
+        }
 
 # -----------------------------
 # Documents & Sharing
 # -----------------------------
 
-@dataclass
+@dataclass(slots=True)
 class DocNote:
     id: str
     start_line: int
@@ -71,7 +228,10 @@ class DocNote:
     author: str = ""
     created_at: float = field(default_factory=lambda: time.time())
 
-@dataclass
+    def to_dict(self) -> dict:
+        return {"id": self.id, "start_line": self.start_line, "end_line": self.end_line, "text": self.text, "author": self.author, "created_at": self.created_at}
+
+@dataclass(slots=True)
 class Document:
     id: str
     name: str
@@ -79,14 +239,33 @@ class Document:
     content: str = ""
     notes: Dict[str, DocNote] = field(default_factory=dict)
     updated_at: float = field(default_factory=lambda: time.time())
+    headings: List[Tuple[str, str]] = field(default_factory=list, init=False, repr=False, compare=False)
+    content_lower: str = field(default="", init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.headings = extract_headings(self.content)
+        self.content_lower = self.content.lower()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "parent_id": self.parent_id,
+            "content": self.content,
+            "notes": {nid: n.to_dict() for nid, n in self.notes.items()},
+            "updated_at": self.updated_at,
+        }
 
-@dataclass
+@dataclass(slots=True)
 class DocFolder:
     id: str
     name: str
     parent_id: Optional[str] = None
 
-@dataclass
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "parent_id": self.parent_id}
+
+@dataclass(slots=True)
 class DocShare:
     id: str  # token
     pin: str
@@ -94,6 +273,9 @@ class DocShare:
     target_id: str  # doc_id or folder_id
     created_at: float = field(default_factory=lambda: time.time())
 
+    def to_dict(self) -> dict:
+        return {"id": self.id, "pin": self.pin, "kind": self.kind, "target_id": self.target_id, "created_at": self.created_at}
+
 # -----------------------------
 # Storage layer (per PIN)
 # -----------------------------
@@ -104,197 +286,565 @@ SHARES_PATH = os.path.join(DATA_DIR, "shares.json")
 
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# Snapshots are written compact: indentation doubled the file size and the
+# bytes written per save. Pipe a file through `python -m json.tool` to read it.
+_JSON_OPTS = orjson.OPT_NON_STR_KEYS
+# fsync before the rename is opt-in; the rename alone already prevents torn files
+FSYNC_WRITES = os.environ.get("VIBE_FSYNC", "") not in ("", "0")
+# Files written by this app carry this marker and always contain every field
+SCHEMA_VERSION = 2
+# Deferred saves are coalesced per PIN and written after this many idle seconds
+SAVE_DELAY = 0.2
+# A PIN's delta log is folded into a fresh snapshot once it grows past this
+WAL_COMPACT_BYTES = 64 * 1024
+
+# Parsed per-PIN files and shares.json, keyed by the file's mtime so an edit
+# made outside the app is still picked up. Handlers mutate the cached objects
+# in place and save_all/save_shares refresh the entry right after writing.
+_CACHE_LOCK = threading.Lock()
+_PIN_CACHE: Dict[str, Tuple[Optional[int], Tuple[Dict[str, Database], Dict[str, DocFolder], Dict[str, Document]]]] = {}
+_SHARES_CACHE: Optional[Tuple[int, Dict[str, DocShare]]] = None
+# shares.json is one file for all PINs; add_share serializes its writers
+_SHARES_LOCK = threading.Lock()
+# PINs whose cached state is ahead of the file, with the timer that flushes it
+_PENDING: Dict[str, threading.Timer] = {}
+# Guards delta-log appends against a snapshot write truncating the log
+_WAL_LOCK = threading.Lock()
+# PINs with delta-log entries not yet folded into their snapshot
+_WAL_PINS: set = set()
+# parent_id -> child ids for folders and documents, dropped on every save and
+# reload; the generation keeps an index built across a save from being stored
+_CHILDREN: Dict[str, Tuple[Dict[Optional[str], List[str]], Dict[Optional[str], List[str]]]] = {}
+_CHILDREN_GEN: Dict[str, int] = {}
+# Encoded /api/state bodies as (dbs they were built from, etag, body). Every
+# save and delta append bumps the PIN's generation so a body encoded while an
+# edit was in flight is never stored.
+_STATE_BODY: Dict[str, Tuple[Dict[str, Database], str, bytes]] = {}
+_STATE_GEN: Dict[str, int] = {}
+# Handlers mutate the cached objects of their PIN in place, and the write-behind
+# timer serializes them; both hold the PIN's lock so neither sees the other
+# half-done, while other PINs proceed independently. Values are weak, so a
+# PIN's lock only lives while something holds it.
+_PIN_LOCKS: weakref.WeakValueDictionary[str, threading.RLock] = weakref.WeakValueDictionary()
+_PIN_LOCKS_GUARD = threading.Lock()
+# Database versions come from one process-wide counter, so an object rebuilt
+# from disk never reuses a version an earlier object handed out
+_DB_VERSIONS = itertools.count(1)
+# Tags page ETags so versions from a previous process never match
+_BOOT_ID = os.urandom(4).hex()
+
 
 def pin_path(pin: str) -> str:
     return os.path.join(DATA_DIR, f"{pin}.json")
 
 
-def load_state(pin: str) -> Dict[str, Database]:
-    path = pin_path(pin)
-    if os.path.exists(path):
+def wal_path(pin: str) -> str:
+    return os.path.join(DATA_DIR, f"{pin}.wal")
+
+
+def _pin_lock(pin: str) -> threading.RLock:
+    with _PIN_LOCKS_GUARD:
+        lock = _PIN_LOCKS.get(pin)
+        if lock is None:
+            lock = _PIN_LOCKS[pin] = threading.RLock()
+    return lock
+
+
+def _drop_children(pin: str) -> None:
+    # caller holds _CACHE_LOCK
+    _CHILDREN.pop(pin, None)
+    _CHILDREN_GEN[pin] = _CHILDREN_GEN.get(pin, 0) + 1
+
+
+def invalidate(pin: str) -> None:
+    with _CACHE_LOCK:
+        _STATE_BODY.pop(pin, None)
+        _STATE_GEN[pin] = _STATE_GEN.get(pin, 0) + 1
+
+
+def _atomic_write_bytes(path: str, data: bytes) -> None:
+    # write the whole buffer to a uniquely named sibling temp file, then swap
+    # it in; a failed write or rename leaves no temp file behind
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            dbs: Dict[str, Database] = {}
-            for db_id, db_data in raw.items():
-                # skip non-database keys
-                if db_id in ("documents", "doc_folders"):
-                    continue
-                if not isinstance(db_data, dict) or "id" not in db_data or "name" not in db_data or "tables" not in db_data:
-                    continue
-                tables = {}
-                for t_id, t in db_data.get("tables", {}).items():
-                    cols: Dict[str, Column] = {}
-                    idx = 0
-                    for c_id, c in t.get("columns", {}).items():
-                        fr = None
-                        if isinstance(c.get("foreign_ref"), dict):
-                            try:
-                                fr = ForeignRef(**c["foreign_ref"])
-                            except Exception:
-                                fr = None
-                        col = Column(
-                            id=c["id"],
-                            name=c["name"],
-                            datatype=c.get("datatype", "TEXT"),
-                            is_primary=bool(c.get("is_primary", False)),
-                            is_nullable=bool(c.get("is_nullable", True)),
-                            default=c.get("default"),
-                            note=c.get("note", ""),
-                            foreign_ref=fr,
-                            order=int(c.get("order", idx)),
-                        )
-                        cols[c_id] = col
-                        idx += 1
-                    tables[t_id] = Table(id=t["id"], name=t["name"], note=t.get("note", ""), columns=cols)
-                links = {l_id: Link(**l) for l_id, l in db_data.get("links", {}).items()}
-                diagram = db_data.get("diagram", {}) or {}
-                dbs[db_id] = Database(id=db_data["id"], name=db_data["name"], note=db_data.get("note", ""), tables=tables, links=links, diagram=diagram)
-            return dbs
-        except Exception:
-            return {}
-    return {}
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+            if FSYNC_WRITES:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        # mkstemp creates 0600; os.chmod (unlike os.fchmod) exists on Windows too
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
 
 
-def save_state(pin: str, dbs: Dict[str, Database]) -> None:
-    path = pin_path(pin)
-    # preserve documents and folders
-    preserved_docs = {}
-    preserved_folders = {}
-    if os.path.exists(path):
+def _mtime_ns(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _fast_build_dbs(raw: dict) -> Dict[str, Database]:
+    # Files tagged with SCHEMA_VERSION were written by save_all, so every key
+    # is present with the right type and no defaults or coercions are needed.
+    dbs: Dict[str, Database] = {}
+    for db_id, db_data in raw.items():
+        if db_id in ("documents", "doc_folders", "_schema"):
+            continue
+        tables = {}
+        for t_id, t in db_data["tables"].items():
+            cols: Dict[str, Column] = {}
+            for c_id, c in t["columns"].items():
+                fr = c["foreign_ref"]
+                if fr is not None:
+                    fr = ForeignRef(fr["table_id"], fr["column_id"], fr["note"])
+                cols[c_id] = Column(c["id"], c["name"], c["datatype"], c["is_primary"], c["is_nullable"], c["default"], c["note"], fr, c["order"])
+            tables[t_id] = Table(t["id"], t["name"], t["note"], cols)
+        links = {l_id: Link(l["id"], l["from_type"], l["from_id"], l["to_type"], l["to_id"], l["note"]) for l_id, l in db_data["links"].items()}
+        dbs[db_id] = Database(db_data["id"], db_data["name"], db_data["note"], tables, links, db_data["diagram"])
+    return dbs
+
+
+def _build_dbs(raw: dict) -> Dict[str, Database]:
+    if raw.get("_schema") == SCHEMA_VERSION:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-                preserved_docs = raw.get("documents", {}) or {}
-                preserved_folders = raw.get("doc_folders", {}) or {}
-        except Exception:
-            preserved_docs, preserved_folders = {}, {}
-    serializable = {}
-    for db_id, db in dbs.items():
-        serializable[db_id] = {
-            "id": db.id,
-            "name": db.name,
-            "note": db.note,
-            "tables": {
-                t_id: {
-                    "id": t.id,
-                    "name": t.name,
-                    "note": t.note,
-                    "columns": {c_id: asdict(c) for c_id, c in t.columns.items()},
-                }
-                for t_id, t in db.tables.items()
-            },
-            "links": {l_id: asdict(l) for l_id, l in db.links.items()},
-            "diagram": db.diagram,
-        }
-    if preserved_folders:
-        serializable["doc_folders"] = preserved_folders
-    if preserved_docs:
-        serializable["documents"] = preserved_docs
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(serializable, f, indent=2)
+            return _fast_build_dbs(raw)
+        except (KeyError, TypeError, AttributeError):
+            pass  # hand-edited file; fall through to the tolerant path
+    # Hot path on every cold load: one Column per stored column. Arguments are
+    # passed positionally and the bool/int coercions only run when the stored
+    # value is not already the right type (files written by this app always are).
+    dbs: Dict[str, Database] = {}
+    for db_id, db_data in raw.items():
+        # skip non-database keys
+        if db_id in ("documents", "doc_folders", "_schema"):
+            continue
+        if not isinstance(db_data, dict) or "id" not in db_data or "name" not in db_data or "tables" not in db_data:
+            continue
+        tables = {}
+        for t_id, t in db_data.get("tables", {}).items():
+            cols: Dict[str, Column] = {}
+            for idx, (c_id, c) in enumerate(t.get("columns", {}).items()):
+                get = c.get
+                fr = get("foreign_ref")
+                if fr is not None:
+                    try:
+                        fr = ForeignRef(**fr) if isinstance(fr, dict) else None
+                    except Exception:
+                        fr = None
+                is_primary = get("is_primary", False)
+                if is_primary.__class__ is not bool:
+                    is_primary = bool(is_primary)
+                is_nullable = get("is_nullable", True)
+                if is_nullable.__class__ is not bool:
+                    is_nullable = bool(is_nullable)
+                order = get("order", idx)
+                if order.__class__ is not int:
+                    order = int(order)
+                cols[c_id] = Column(
+                    c["id"],
+                    c["name"],
+                    get("datatype", "TEXT"),
+                    is_primary,
+                    is_nullable,
+                    get("default"),
+                    get("note", ""),
+                    fr,
+                    order,
+                )
+            tables[t_id] = Table(id=t["id"], name=t["name"], note=t.get("note", ""), columns=cols)
+        links = {l_id: Link(**l) for l_id, l in db_data.get("links", {}).items()}
+        diagram = db_data.get("diagram", {}) or {}
+        dbs[db_id] = Database(id=db_data["id"], name=db_data["name"], note=db_data.get("note", ""), tables=tables, links=links, diagram=diagram)
+    return dbs
+
+
+def _build_docs(raw: dict) -> Tuple[Dict[str, DocFolder], Dict[str, Document]]:
+    folders: Dict[str, DocFolder] = {}
+    documents: Dict[str, Document] = {}
+    for fid, fdata in raw.get("doc_folders", {}).items():
+        folders[fid] = DocFolder(id=fdata["id"], name=fdata["name"], parent_id=fdata.get("parent_id"))
+    for did, ddata in raw.get("documents", {}).items():
+        notes: Dict[str, DocNote] = {}
+        for nid, ndata in ddata.get("notes", {}).items():
+            try:
+                notes[nid] = DocNote(
+                    id=ndata["id"],
+                    start_line=int(ndata.get("start_line", 1)),
+                    end_line=int(ndata.get("end_line", ndata.get("start_line", 1))),
+                    text=ndata.get("text", ""),
+                    author=ndata.get("author", ""),
+                    created_at=float(ndata.get("created_at", time.time())),
+                )
+            except Exception:
+                continue
+        documents[did] = Document(
+            id=ddata["id"],
+            name=ddata["name"],
+            parent_id=ddata.get("parent_id"),
+            content=ddata.get("content", ""),
+            notes=notes,
+            updated_at=float(ddata.get("updated_at", time.time())),
+        )
+    return folders, documents
 
 
-def load_docs(pin: str) -> Tuple[Dict[str, DocFolder], Dict[str, Document]]:
+def load_all(pin: str) -> Tuple[Dict[str, Database], Dict[str, DocFolder], Dict[str, Document]]:
     path = pin_path(pin)
-    if not os.path.exists(path):
-        return {}, {}
+    mtime = _mtime_ns(path)
+    with _CACHE_LOCK:
+        hit = _PIN_CACHE.get(pin)
+        pending = pin in _PENDING
+    # while a deferred save is pending the cache is newer than the file
+    if hit and (pending or hit[0] == mtime):
+        return hit[1]
+    # A PIN with no file is not cached: any cookie value reaches this point,
+    # so only PINs that have saved something get an entry.
+    if mtime is None:
+        return {}, {}, {}
+    # read the snapshot and its delta log as one pair, so a compaction can't
+    # land between the two reads
+    with _WAL_LOCK:
+        try:
+            with open(path, "rb") as f:
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+                data = f.read()
+        except OSError:
+            return {}, {}, {}
+        try:
+            with open(wal_path(pin), "rb") as f:
+                wal: Optional[bytes] = f.read()
+        except FileNotFoundError:
+            wal = None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-        folders: Dict[str, DocFolder] = {}
-        documents: Dict[str, Document] = {}
-        for fid, fdata in raw.get("doc_folders", {}).items():
-            folders[fid] = DocFolder(id=fdata["id"], name=fdata["name"], parent_id=fdata.get("parent_id"))
-        for did, ddata in raw.get("documents", {}).items():
-            notes: Dict[str, DocNote] = {}
-            for nid, ndata in ddata.get("notes", {}).items():
-                try:
-                    notes[nid] = DocNote(
-                        id=ndata["id"],
-                        start_line=int(ndata.get("start_line", 1)),
-                        end_line=int(ndata.get("end_line", ndata.get("start_line", 1))),
-                        text=ndata.get("text", ""),
-                        author=ndata.get("author", ""),
-                        created_at=float(ndata.get("created_at", time.time())),
-                    )
-                except Exception:
-                    continue
-            documents[did] = Document(
-                id=ddata["id"],
-                name=ddata["name"],
-                parent_id=ddata.get("parent_id"),
-                content=ddata.get("content", ""),
-                notes=notes,
-                updated_at=float(ddata.get("updated_at", time.time())),
-            )
-        return folders, documents
+        raw = orjson.loads(data)
+    except Exception:
+        return {}, {}, {}
+    try:
+        dbs = _build_dbs(raw)
+        _replay_wal(pin, dbs, wal)
+    except Exception:
+        dbs = {}
+    try:
+        folders, documents = _build_docs(raw)
     except Exception:
-        return {}, {}
+        folders, documents = {}, {}
+    with _CACHE_LOCK:
+        current = _PIN_CACHE.get(pin)
+        # Another request stored (and may already be editing) objects while
+        # this one was parsing; hand those out rather than replacing them,
+        # or edits only recorded in the delta log would be dropped.
+        if current is not None and current is not hit:
+            return current[1]
+        _PIN_CACHE[pin] = (mtime, (dbs, folders, documents))
+        _drop_children(pin)
+    return dbs, folders, documents
+
+
+def _write_pin(pin: str, dbs: Dict[str, Database], folders: Dict[str, DocFolder], documents: Dict[str, Document]) -> None:
+    path = pin_path(pin)
+    # The snapshot is taken under the log lock: an edit is applied in memory
+    # before its delta is appended, so every logged delta is in the snapshot
+    # and the log can go with it. A delta appended meanwhile lands after.
+    with _WAL_LOCK:
+        serializable = {db_id: db.to_dict() for db_id, db in dbs.items()}
+        if folders:
+            serializable["doc_folders"] = {fid: f.to_dict() for fid, f in folders.items()}
+        if documents:
+            serializable["documents"] = {did: d.to_dict() for did, d in documents.items()}
+        serializable["_schema"] = SCHEMA_VERSION
+        _atomic_write_bytes(path, orjson.dumps(serializable, option=_JSON_OPTS))
+        if pin in _WAL_PINS:
+            try:
+                os.remove(wal_path(pin))
+            except FileNotFoundError:
+                pass
+            _WAL_PINS.discard(pin)
+    with _CACHE_LOCK:
+        _PIN_CACHE[pin] = (os.stat(path).st_mtime_ns, (dbs, folders, documents))
+
+
+def _flush(pin: str) -> None:
+    with _pin_lock(pin):
+        with _CACHE_LOCK:
+            if _PENDING.pop(pin, None) is None:
+                return
+            _, (dbs, folders, documents) = _PIN_CACHE[pin]
+        _write_pin(pin, dbs, folders, documents)
+
+
+def _flush_all() -> None:
+    with _CACHE_LOCK:
+        pins = list(_PENDING)
+    for pin in pins:
+        _flush(pin)
+    # fold leftover delta logs into their snapshots on the way out
+    with _WAL_LOCK:
+        wal_pins = list(_WAL_PINS)
+    for pin in wal_pins:
+        with _pin_lock(pin):
+            with _CACHE_LOCK:
+                hit = _PIN_CACHE.get(pin)
+            if hit:
+                _write_pin(pin, *hit[1])
+
+
+atexit.register(_flush_all)
+
+
+def save_all(pin: str, dbs: Dict[str, Database], folders: Dict[str, DocFolder], documents: Dict[str, Document], immediate: bool = True) -> None:
+    # Deferred saves only update the cache and (re)arm the PIN's flush timer,
+    # so a burst of edits is written once. An immediate save supersedes any
+    # pending flush since it writes the same objects.
+    invalidate(pin)
+    with _CACHE_LOCK:
+        _drop_children(pin)
+        timer = _PENDING.pop(pin, None)
+        if timer:
+            timer.cancel()
+        if not immediate:
+            prev = _PIN_CACHE.get(pin)
+            mtime = prev[0] if prev else _mtime_ns(pin_path(pin))
+            _PIN_CACHE[pin] = (mtime, (dbs, folders, documents))
+            timer = threading.Timer(SAVE_DELAY, _flush, args=(pin,))
+            timer.daemon = True
+            _PENDING[pin] = timer
+            timer.start()
+            return
+    _write_pin(pin, dbs, folders, documents)
 
 
-def save_docs(pin: str, folders: Dict[str, DocFolder], documents: Dict[str, Document]) -> None:
-    path = pin_path(pin)
-    raw = {}
-    if os.path.exists(path):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-        except Exception:
-            raw = {}
-    raw["doc_folders"] = {fid: asdict(f) for fid, f in folders.items()}
-    raw["documents"] = {did: {
-        "id": d.id,
-        "name": d.name,
-        "parent_id": d.parent_id,
-        "content": d.content,
-        "notes": {nid: asdict(n) for nid, n in d.notes.items()},
-        "updated_at": d.updated_at,
-    } for did, d in documents.items()}
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(raw, f, indent=2)
+def load_state(pin: str) -> Dict[str, Database]:
+    return load_all(pin)[0]
+
+
+def save_state(pin: str, dbs: Dict[str, Database], immediate: bool = True) -> None:
+    _, folders, documents = load_all(pin)
+    save_all(pin, dbs, folders, documents, immediate=immediate)
+
+
+def load_docs(pin: str) -> Tuple[Dict[str, DocFolder], Dict[str, Document]]:
+    _, folders, documents = load_all(pin)
+    return folders, documents
+
+
+def save_docs(pin: str, folders: Dict[str, DocFolder], documents: Dict[str, Document], immediate: bool = False) -> None:
+    dbs = load_all(pin)[0]
+    save_all(pin, dbs, folders, documents, immediate=immediate)
+
+
+def load_children(pin: str) -> Tuple[Dict[Optional[str], List[str]], Dict[Optional[str], List[str]]]:
+    # Built once per saved version of the PIN's docs, so read-only requests
+    # (shared views, folder deletes) look children up instead of scanning.
+    with _CACHE_LOCK:
+        gen = _CHILDREN_GEN.get(pin, 0)
+    folders, documents = load_docs(pin)
+    with _CACHE_LOCK:
+        hit = _CHILDREN.get(pin)
+    if hit is not None:
+        return hit
+    folder_children: Dict[Optional[str], List[str]] = {}
+    for fid, f in folders.items():
+        folder_children.setdefault(f.parent_id, []).append(fid)
+    doc_children: Dict[Optional[str], List[str]] = {}
+    for did, d in documents.items():
+        doc_children.setdefault(d.parent_id, []).append(did)
+    with _CACHE_LOCK:
+        if _CHILDREN_GEN.get(pin, 0) == gen:
+            _CHILDREN[pin] = (folder_children, doc_children)
+    return folder_children, doc_children
 
 
 def load_shares() -> Dict[str, DocShare]:
+    global _SHARES_CACHE
     os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(SHARES_PATH):
+    mtime = _mtime_ns(SHARES_PATH)
+    if mtime is None:
         return {}
+    with _CACHE_LOCK:
+        hit = _SHARES_CACHE
+    if hit and hit[0] == mtime:
+        return hit[1]
     try:
-        with open(SHARES_PATH, "r", encoding="utf-8") as f:
-            raw = json.load(f)
+        with open(SHARES_PATH, "rb") as f:
+            raw = orjson.loads(f.read())
         shares: Dict[str, DocShare] = {}
         for token, s in raw.items():
             shares[token] = DocShare(id=s["id"], pin=s["pin"], kind=s["kind"], target_id=s["target_id"], created_at=s.get("created_at", time.time()))
+        with _CACHE_LOCK:
+            _SHARES_CACHE = (mtime, shares)
         return shares
     except Exception:
         return {}
 
 
 def save_shares(shares: Dict[str, DocShare]) -> None:
+    global _SHARES_CACHE
     os.makedirs(DATA_DIR, exist_ok=True)
-    serializable = {token: asdict(s) for token, s in shares.items()}
-    with open(SHARES_PATH, "w", encoding="utf-8") as f:
-        json.dump(serializable, f, indent=2)
+    _atomic_write_bytes(SHARES_PATH, orjson.dumps({token: s.to_dict() for token, s in shares.items()}, option=_JSON_OPTS))
+    with _CACHE_LOCK:
+        _SHARES_CACHE = (os.stat(SHARES_PATH).st_mtime_ns, shares)
 
 
-def slugify(name: str) -> str:
-    s = name.strip().lower()
-    s = re.sub(r"\s+", "-", s)
-    s = re.sub(r"[^a-z0-9\-_.]", "", s)
-    s = re.sub(r"-+", "-", s)
-    return s.strip("-")
+def add_share(share: DocShare) -> None:
+    # The cached dict is shared by every request, so it is never edited in
+    # place: a copy gets the new token and replaces it once written. A failed
+    # write leaves the cache as it was.
+    with _SHARES_LOCK:
+        shares = dict(load_shares())
+        shares[share.id] = share
+        save_shares(shares)
+
+
+# -----------------------------
+# Delta log (per PIN)
+# -----------------------------
+# High-frequency schema edits append one JSON line describing the change to
+# .pin_data/<PIN>.wal instead of rewriting the whole file. Every delta carries
+# the resulting values rather than a diff, so replaying one that the snapshot
+# already contains is harmless.
+
+def append_delta(pin: str, delta: dict) -> None:
+    invalidate(pin)
+    line = orjson.dumps(delta) + b"\n"
+    with _WAL_LOCK:
+        with open(wal_path(pin), "ab") as f:
+            f.write(line)
+            if FSYNC_WRITES:
+                f.flush()
+                os.fsync(f.fileno())
+            size = f.tell()
+        _WAL_PINS.add(pin)
+    if size > WAL_COMPACT_BYTES:
+        # let the write-behind timer take the snapshot off the request thread
+        dbs, folders, documents = load_all(pin)
+        save_all(pin, dbs, folders, documents, immediate=False)
+
+
+def _column_from_dict(c: dict) -> Column:
+    fr = c.get("foreign_ref")
+    return Column(**{**c, "foreign_ref": ForeignRef(**fr) if fr else None})
+
+
+def _apply_delta(dbs: Dict[str, Database], delta: dict) -> None:
+    op = delta.get("op")
+    if op == "db.dup":
+        dbs.update(_build_dbs({delta["db"]: delta["data"]}))
+        return
+    db = dbs.get(delta.get("db"))
+    if db is None:
+        return
+    if op == "col.upd":
+        t = db.tables.get(delta["t"])
+        if t is not None:
+            col = _column_from_dict(delta["col"])
+            t.columns[col.id] = col
+    elif op == "col.del":
+        t = db.tables.get(delta["t"])
+        if t is not None:
+            t.columns.pop(delta["c"], None)
+        for l_id in delta.get("links", ()):
+            db.remove_link(l_id)
+    elif op in ("link.add", "link.upd"):
+        db.add_link(Link(**delta["link"]))
+    elif op == "link.del":
+        db.remove_link(delta["l"])
+
+
+def _replay_wal(pin: str, dbs: Dict[str, Database], wal: Optional[bytes]) -> None:
+    # wal is the log's content, read by load_all under _WAL_LOCK
+    if wal is None:
+        return
+    for line in wal.splitlines():
+        try:
+            delta = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            break  # torn final append
+        try:
+            _apply_delta(dbs, delta)
+        except Exception:
+            continue
+    with _WAL_LOCK:
+        _WAL_PINS.add(pin)
+
 
 # -----------------------------
 # Flask app
 # -----------------------------
 
+class OrjsonProvider(JSONProvider):
+    # Routes jsonify() and request.get_json() through orjson. Keys are never sorted
+    # and output is compact; responses are built from the encoded bytes.
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json")
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 
 def get_pin() -> Optional[str]:
     return request.cookies.get(PIN_COOKIE)
 
 
+def with_pin_lock(view):
+    # Runs the view under the cookie PIN's lock (see _pin_lock). Every handler
+    # that reads or mutates a PIN's cached state is wrapped, since they all
+    # share the same live dicts.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        pin = get_pin()
+        if not pin:
+            return view(*args, **kwargs)
+        with _pin_lock(pin):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def with_share_lock(view):
+    # Same as with_pin_lock for the share-link views, which act on the PIN
+    # that owns the share named by the `token` URL argument.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        s = load_shares().get(kwargs.get("token"))
+        if s is None:
+            return view(*args, **kwargs)
+        with _pin_lock(s.pin):
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def _json_response(obj) -> Response:
+    # orjson straight to bytes; pass plain dicts (to_dict()), not models, so
+    # runtime-only fields never reach the client
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json")
+
+
+def _ack(key: str, data: dict) -> Response:
+    # The UI refetches /api/state after every edit, so mutations answer with
+    # the id only; ?echo=1 still returns the full object under `key`.
+    if request.args.get("echo") == "1":
+        return jsonify({"ok": True, key: data})
+    return jsonify({"ok": True, "id": data["id"]})
+
+
 def get_state_or_init(pin: str) -> Dict[str, Database]:
     return load_state(pin)
 
@@ -314,30 +864,33 @@ def index():
 
 
 @app.route("/workspace")
+@with_pin_lock
 def workspace():
     pin = get_pin()
     if not pin:
         return redirect(url_for("index"))
-    dbs = get_state_or_init(pin)
-    folders, documents = load_docs(pin)
+    dbs, folders, documents = load_all(pin)
     return render_template("workspace.html", pin=pin, dbs=dbs, folders=folders, documents=documents)
 
 # --------- Databases ----------
 
 @app.post("/api/databases")
+@with_pin_lock
 def create_database():
     pin = get_pin()
     if not pin:
         abort(401)
     dbs = get_state_or_init(pin)
-    name = request.json.get("name", "New Database").strip() or "New Database"
+    data = request.get_json(silent=True) or {}
+    name = data.get("name", "New Database").strip() or "New Database"
     db_id = gen_id()
     dbs[db_id] = Database(id=db_id, name=name)
     save_state(pin, dbs)
-    return jsonify({"ok": True, "database": asdict(dbs[db_id])})
+    return jsonify({"ok": True, "database": dbs[db_id].to_dict()})
 
 
 @app.delete("/api/databases/<db_id>")
+@with_pin_lock
 def delete_database(db_id: str):
     pin = get_pin()
     if not pin:
@@ -351,6 +904,7 @@ def delete_database(db_id: str):
 
 
 @app.patch("/api/databases/<db_id>")
+@with_pin_lock
 def update_database(db_id: str):
     pin = get_pin()
     if not pin:
@@ -359,20 +913,23 @@ def update_database(db_id: str):
     db = dbs.get(db_id)
     if not db:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     if "name" in data:
         db.name = data["name"].strip() or db.name
+        db.slug = slugify(db.name)
     if "note" in data:
         db.note = data["note"]
     if "diagram" in data and isinstance(data["diagram"], dict):
         # Minimal sanitation: ensure it's a dict of simple types
         db.diagram = data["diagram"]
+    db.touch()
     save_state(pin, dbs)
-    return jsonify({"ok": True, "database": asdict(db)})
+    return jsonify({"ok": True, "database": db.to_dict()})
 
 # --------- Docs: Browse Pages ---------
 
 @app.get("/docs")
+@with_pin_lock
 def docs_home():
     pin = get_pin()
     if not pin:
@@ -382,6 +939,7 @@ def docs_home():
 
 
 @app.get("/docs/f/<folder_id>")
+@with_pin_lock
 def docs_folder(folder_id: str):
     pin = get_pin()
     if not pin:
@@ -393,6 +951,7 @@ def docs_folder(folder_id: str):
 
 
 @app.get("/docs/d/<doc_id>")
+@with_pin_lock
 def docs_doc_editor(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -407,23 +966,25 @@ def docs_doc_editor(doc_id: str):
 # --------- Docs: API CRUD ---------
 
 @app.post("/api/docs/folders")
+@with_pin_lock
 def api_create_folder():
     pin = get_pin()
     if not pin:
         abort(401)
     folders, documents = load_docs(pin)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     name = (data.get("name") or "New Folder").strip() or "New Folder"
     parent_id = data.get("parent_id") or None
     if parent_id and parent_id not in folders:
         abort(400)
     fid = gen_id()
     folders[fid] = DocFolder(id=fid, name=name, parent_id=parent_id)
-    save_docs(pin, folders, documents)
-    return jsonify({"ok": True, "folder": asdict(folders[fid])})
+    save_docs(pin, folders, documents, immediate=True)
+    return jsonify({"ok": True, "folder": folders[fid].to_dict()})
 
 
 @app.patch("/api/docs/folders/<fid>")
+@with_pin_lock
 def api_update_folder(fid: str):
     pin = get_pin()
     if not pin:
@@ -432,19 +993,23 @@ def api_update_folder(fid: str):
     f = folders.get(fid)
     if not f:
         abort(404)
-    data = request.json or {}
-    if "name" in data:
-        f.name = data["name"].strip() or f.name
+    data = request.get_json(silent=True) or {}
+    # validate every field before mutating: the loaded folders are shared via the cache
+    pid = data.get("parent_id")
+    if pid is not None and (not isinstance(pid, str) or (pid and pid not in folders)):
+        abort(400)
+    if "name" in data and not isinstance(data["name"], str):
+        abort(400)
     if "parent_id" in data:
-        pid = data.get("parent_id")
-        if pid and pid not in folders:
-            abort(400)
         f.parent_id = pid
-    save_docs(pin, folders, documents)
-    return jsonify({"ok": True, "folder": asdict(f)})
+    if "name" in data:
+        f.name = data["name"].strip() or f.name
+    save_docs(pin, folders, documents, immediate=True)
+    return jsonify({"ok": True, "folder": f.to_dict()})
 
 
 @app.delete("/api/docs/folders/<fid>")
+@with_pin_lock
 def api_delete_folder(fid: str):
     pin = get_pin()
     if not pin:
@@ -453,20 +1018,22 @@ def api_delete_folder(fid: str):
     if fid not in folders:
         abort(404)
     # prevent delete if contains items
-    if any(d.parent_id == fid for d in documents.values()) or any(f.parent_id == fid for f in folders.values() if f.id != fid):
+    folder_children, doc_children = load_children(pin)
+    if doc_children.get(fid) or any(c != fid for c in folder_children.get(fid, ())):
         abort(400, "Folder not empty")
     folders.pop(fid)
-    save_docs(pin, folders, documents)
+    save_docs(pin, folders, documents, immediate=True)
     return jsonify({"ok": True})
 
 
 @app.post("/api/docs")
+@with_pin_lock
 def api_create_doc():
     pin = get_pin()
     if not pin:
         abort(401)
     folders, documents = load_docs(pin)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     name = (data.get("name") or "Untitled").strip() or "Untitled"
     parent_id = data.get("parent_id") or None
     if parent_id and parent_id not in folders:
@@ -475,10 +1042,11 @@ def api_create_doc():
     content = data.get("content") or f"# {name}\n\nStart writing...\n"
     documents[did] = Document(id=did, name=name, parent_id=parent_id, content=content)
     save_docs(pin, folders, documents)
-    return jsonify({"ok": True, "document": asdict(documents[did])})
+    return jsonify({"ok": True, "document": documents[did].to_dict()})
 
 
 @app.get("/api/docs/<doc_id>")
+@with_pin_lock
 def api_get_doc(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -487,10 +1055,11 @@ def api_get_doc(doc_id: str):
     d = documents.get(doc_id)
     if not d:
         abort(404)
-    return jsonify({"ok": True, "document": asdict(d)})
+    return jsonify({"ok": True, "document": d.to_dict()})
 
 
 @app.patch("/api/docs/<doc_id>")
+@with_pin_lock
 def api_update_doc(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -499,27 +1068,34 @@ def api_update_doc(doc_id: str):
     d = documents.get(doc_id)
     if not d:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     touched = False
-    if "name" in data:
-        d.name = data["name"].strip() or d.name
-        touched = True
-    if "parent_id" in data:
-        pid = data.get("parent_id")
-        if pid and pid not in folders:
+    # validate every field before mutating: the loaded documents are shared via the cache
+    pid = data.get("parent_id")
+    if pid is not None and (not isinstance(pid, str) or (pid and pid not in folders)):
+        abort(400)
+    for key in ("name", "content"):
+        if key in data and not isinstance(data[key], str):
             abort(400)
+    if "parent_id" in data:
         d.parent_id = pid
         touched = True
+    if "name" in data:
+        d.name = data["name"].strip() or d.name
+        touched = True
     if "content" in data:
         d.content = data["content"]
+        d.headings = extract_headings(d.content)
+        d.content_lower = d.content.lower()
         touched = True
     if touched:
         d.updated_at = time.time()
     save_docs(pin, folders, documents)
-    return jsonify({"ok": True, "document": asdict(d)})
+    return jsonify({"ok": True, "document": d.to_dict()})
 
 
 @app.delete("/api/docs/<doc_id>")
+@with_pin_lock
 def api_delete_doc(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -533,6 +1109,7 @@ def api_delete_doc(doc_id: str):
 
 
 @app.get("/api/docs/<doc_id>/notes")
+@with_pin_lock
 def api_get_notes(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -541,10 +1118,11 @@ def api_get_notes(doc_id: str):
     d = documents.get(doc_id)
     if not d:
         abort(404)
-    return jsonify({"ok": True, "notes": {nid: asdict(n) for nid, n in d.notes.items()}})
+    return jsonify({"ok": True, "notes": {nid: n.to_dict() for nid, n in d.notes.items()}})
 
 
 @app.post("/api/docs/<doc_id>/notes")
+@with_pin_lock
 def api_add_note(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -553,7 +1131,7 @@ def api_add_note(doc_id: str):
     d = documents.get(doc_id)
     if not d:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     try:
         start_line = int(data.get("start_line", 1))
         end_line = int(data.get("end_line", start_line))
@@ -567,10 +1145,11 @@ def api_add_note(doc_id: str):
     d.notes[nid] = DocNote(id=nid, start_line=start_line, end_line=end_line, text=text, author=author)
     d.updated_at = time.time()
     save_docs(pin, folders, documents)
-    return jsonify({"ok": True, "note": asdict(d.notes[nid])})
+    return jsonify({"ok": True, "note": d.notes[nid].to_dict()})
 
 
 @app.delete("/api/docs/<doc_id>/notes/<nid>")
+@with_pin_lock
 def api_delete_note(doc_id: str, nid: str):
     pin = get_pin()
     if not pin:
@@ -590,6 +1169,7 @@ def api_delete_note(doc_id: str, nid: str):
 # --------- Sharing ---------
 
 @app.post("/api/docs/<doc_id>/share")
+@with_pin_lock
 def api_share_doc(doc_id: str):
     pin = get_pin()
     if not pin:
@@ -597,14 +1177,13 @@ def api_share_doc(doc_id: str):
     folders, documents = load_docs(pin)
     if doc_id not in documents:
         abort(404)
-    shares = load_shares()
     token = gen_id()
-    shares[token] = DocShare(id=token, pin=pin, kind='doc', target_id=doc_id)
-    save_shares(shares)
+    add_share(DocShare(id=token, pin=pin, kind='doc', target_id=doc_id))
     return jsonify({"ok": True, "token": token, "url": url_for('shared_doc', token=token, _external=True)})
 
 
 @app.post("/api/docs/folders/<fid>/share")
+@with_pin_lock
 def api_share_folder(fid: str):
     pin = get_pin()
     if not pin:
@@ -612,13 +1191,23 @@ def api_share_folder(fid: str):
     folders, documents = load_docs(pin)
     if fid not in folders:
         abort(404)
-    shares = load_shares()
     token = gen_id()
-    shares[token] = DocShare(id=token, pin=pin, kind='folder', target_id=fid)
-    save_shares(shares)
+    add_share(DocShare(id=token, pin=pin, kind='folder', target_id=fid))
     return jsonify({"ok": True, "token": token, "url": url_for('shared_folder', token=token, _external=True)})
 
 
+def _subtree_ids(children: Dict[Optional[str], List[str]], root: str) -> set:
+    subtree = set()
+    pending = [root]
+    while pending:
+        x = pending.pop()
+        subtree.add(x)
+        for fid in children.get(x, ()):
+            if fid not in subtree:
+                pending.append(fid)
+    return subtree
+
+
 def _shared_context(token: str) -> Tuple[DocShare, Dict[str, DocFolder], Dict[str, Document]]:
     shares = load_shares()
     s = shares.get(token)
@@ -629,6 +1218,7 @@ def _shared_context(token: str) -> Tuple[DocShare, Dict[str, DocFolder], Dict[st
 
 
 @app.get("/s/d/<token>")
+@with_share_lock
 def shared_doc(token: str):
     s, folders, documents = _shared_context(token)
     if s.kind != 'doc':
@@ -638,10 +1228,11 @@ def shared_doc(token: str):
         abort(404)
     # read-only unless cookie matches pin
     can_edit = (get_pin() == s.pin)
-    return render_template("document.html", doc=doc, folders=folders, can_edit=can_edit, share=asdict(s), is_shared=True)
+    return render_template("document.html", doc=doc, folders=folders, can_edit=can_edit, share=s.to_dict(), is_shared=True)
 
 
 @app.get("/s/f/<token>")
+@with_share_lock
 def shared_folder(token: str):
     s, folders, documents = _shared_context(token)
     if s.kind != 'folder':
@@ -650,10 +1241,11 @@ def shared_folder(token: str):
     if not root:
         abort(404)
     can_edit = (get_pin() == s.pin)
-    return render_template("docs.html", pin=None, folders=folders, documents=documents, current_folder=root.id, share=asdict(s), can_edit=can_edit, is_shared=True)
+    return render_template("docs.html", pin=None, folders=folders, documents=documents, current_folder=root.id, share=s.to_dict(), can_edit=can_edit, is_shared=True)
 
 
 @app.get("/s/f/<token>/d/<doc_id>")
+@with_share_lock
 def shared_folder_doc(token: str, doc_id: str):
     s, folders, documents = _shared_context(token)
     if s.kind != 'folder':
@@ -662,43 +1254,31 @@ def shared_folder_doc(token: str, doc_id: str):
     if not doc:
         abort(404)
     # ensure doc is within subtree of shared folder
-    subtree = set()
     root = s.target_id
-    pending = [root]
-    while pending:
-        x = pending.pop()
-        subtree.add(x)
-        for fid, f in folders.items():
-            if f.parent_id == x and fid not in subtree:
-                pending.append(fid)
+    subtree = _subtree_ids(load_children(s.pin)[0], root)
     if doc.parent_id not in subtree and doc.parent_id != root:
         abort(403)
     can_edit = (get_pin() == s.pin)
-    return render_template("document.html", doc=doc, folders=folders, can_edit=can_edit, share=asdict(s), is_shared=True)
+    return render_template("document.html", doc=doc, folders=folders, can_edit=can_edit, share=s.to_dict(), is_shared=True)
 
 
 @app.get("/s/f/<token>/f/<folder_id>")
+@with_share_lock
 def shared_folder_sub(token: str, folder_id: str):
     s, folders, documents = _shared_context(token)
     if s.kind != 'folder':
         abort(404)
     # ensure folder is within subtree of shared root
-    subtree = set()
     root = s.target_id
-    pending = [root]
-    while pending:
-        x = pending.pop()
-        subtree.add(x)
-        for fid, f in folders.items():
-            if f.parent_id == x and fid not in subtree:
-                pending.append(fid)
+    subtree = _subtree_ids(load_children(s.pin)[0], root)
     if folder_id not in subtree and folder_id != root:
         abort(403)
     can_edit = (get_pin() == s.pin)
-    return render_template("docs.html", pin=None, folders=folders, documents=documents, current_folder=folder_id, share=asdict(s), can_edit=can_edit, is_shared=True)
+    return render_template("docs.html", pin=None, folders=folders, documents=documents, current_folder=folder_id, share=s.to_dict(), can_edit=can_edit, is_shared=True)
 
 
 @app.post("/api/shared/d/<token>/<doc_id>/notes")
+@with_share_lock
 def api_shared_add_note(token: str, doc_id: str):
     # Readers can add notes via share token
     s, folders, documents = _shared_context(token)
@@ -709,18 +1289,11 @@ def api_shared_add_note(token: str, doc_id: str):
         abort(404)
     # If folder share, ensure doc is within subtree
     if s.kind == 'folder':
-        subtree = set()
         root = s.target_id
-        pending = [root]
-        while pending:
-            x = pending.pop()
-            subtree.add(x)
-            for fid, f in folders.items():
-                if f.parent_id == x and fid not in subtree:
-                    pending.append(fid)
+        subtree = _subtree_ids(load_children(s.pin)[0], root)
         if d.parent_id not in subtree and d.parent_id != root:
             abort(403)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     try:
         start_line = int(data.get("start_line", 1))
         end_line = int(data.get("end_line", start_line))
@@ -734,10 +1307,11 @@ def api_shared_add_note(token: str, doc_id: str):
     d.notes[nid] = DocNote(id=nid, start_line=start_line, end_line=end_line, text=text, author=author)
     # Save to the pin that owns this share
     save_docs(s.pin, folders, documents)
-    return jsonify({"ok": True, "note": asdict(d.notes[nid])})
+    return jsonify({"ok": True, "note": d.notes[nid].to_dict()})
 
 
 @app.get("/api/shared/resolve/<token>/doc/<doc_id>")
+@with_share_lock
 def api_shared_resolve_doc(token: str, doc_id: str):
     s, folders, documents = _shared_context(token)
     d = documents.get(doc_id)
@@ -746,15 +1320,8 @@ def api_shared_resolve_doc(token: str, doc_id: str):
     allowed = True
     url = None
     if s.kind == 'folder':
-        subtree = set()
         root = s.target_id
-        pending = [root]
-        while pending:
-            x = pending.pop()
-            subtree.add(x)
-            for fid, f in folders.items():
-                if f.parent_id == x and fid not in subtree:
-                    pending.append(fid)
+        subtree = _subtree_ids(load_children(s.pin)[0], root)
         allowed = (d.parent_id in subtree) or (d.parent_id == root)
         if allowed:
             url = url_for('shared_folder_doc', token=token, doc_id=doc_id)
@@ -769,78 +1336,72 @@ def api_shared_resolve_doc(token: str, doc_id: str):
 # --------- Search API (docs + database items) ---------
 
 @app.get("/api/search")
+@with_pin_lock
 def api_search():
     pin = get_pin()
     if not pin:
         abort(401)
     q = (request.args.get('q') or '').strip().lower()
-    folders, documents = load_docs(pin)
-    dbs = get_state_or_init(pin)
+    dbs, folders, documents = load_all(pin)
     results = []
     for d in documents.values():
-        if q in d.name.lower() or (q and q in d.content.lower()):
+        if q in d.name.lower() or (q and q in d.content_lower):
             results.append({"type":"doc","id":d.id,"name":d.name, "parent_id": d.parent_id})
-        for line in d.content.splitlines():
-            if line.startswith('#'):
-                heading = line.lstrip('#').strip()
-                if heading and (q in heading.lower()):
-                    results.append({"type":"heading","doc_id":d.id,"heading":heading, "doc_name": d.name, "parent_id": d.parent_id})
+        for heading, heading_lower in d.headings:
+            if q in heading_lower:
+                results.append({"type":"heading","doc_id":d.id,"heading":heading, "doc_name": d.name, "parent_id": d.parent_id})
     for db_id, db in dbs.items():
-        db_slug = slugify(db.name)
+        db_slug = db.slug
         if q in db_slug:
             results.append({"type":"database","db_id":db_id,"name":db.name,"slug":db_slug})
         for t_id, t in db.tables.items():
-            t_slug = slugify(t.name)
+            t_slug = t.slug
             if q in t_slug:
                 results.append({"type":"table","db_id":db_id,"table_id":t_id,"name":t.name,"slug":t_slug})
             for c_id, c in t.columns.items():
-                c_slug = slugify(c.name)
+                c_slug = c.slug
                 label = f"{t_slug}.{c_slug}"
                 if q in c_slug or q in label:
                     results.append({"type":"column","db_id":db_id,"table_id":t_id,"column_id":c_id,"name":c.name,"slug":c_slug,"label":label})
-    return jsonify({"ok": True, "results": results[:50]})
+    return _json_response({"ok": True, "results": results[:50]})
 
 
 # --------- Docs listing APIs (minimal) ---------
 
 @app.get("/api/docs/state")
+@with_pin_lock
 def api_docs_state():
     pin = get_pin()
     if not pin:
         abort(401)
     folders, documents = load_docs(pin)
     # minimal state, no content
-    mf = {fid: {"id": f.id, "name": f.name, "parent_id": f.parent_id} for fid, f in folders.items()}
+    mf = {fid: f.to_dict() for fid, f in folders.items()}
     md = {did: {"id": d.id, "name": d.name, "parent_id": d.parent_id, "updated_at": d.updated_at} for did, d in documents.items()}
-    return jsonify({"ok": True, "folders": mf, "documents": md})
+    return _json_response({"ok": True, "folders": mf, "documents": md})
 
 
 @app.get("/api/shared/f/<token>/state")
+@with_share_lock
 def api_shared_docs_state(token: str):
     s, folders, documents = _shared_context(token)
     if s.kind != 'folder':
         abort(404)
     # build subtree folder ids
-    subtree = set()
     root = s.target_id
-    pending = [root]
-    while pending:
-        x = pending.pop()
-        subtree.add(x)
-        for fid, f in folders.items():
-            if f.parent_id == x and fid not in subtree:
-                pending.append(fid)
+    subtree = _subtree_ids(load_children(s.pin)[0], root)
     # include only folders in subtree and docs under them
-    mf = {fid: {"id": folders[fid].id, "name": folders[fid].name, "parent_id": folders[fid].parent_id} for fid in subtree if fid in folders}
+    mf = {fid: folders[fid].to_dict() for fid in subtree if fid in folders}
     md = {}
     for did, d in documents.items():
         if d.parent_id in subtree or d.parent_id == root:
             md[did] = {"id": d.id, "name": d.name, "parent_id": d.parent_id, "updated_at": d.updated_at}
-    return jsonify({"ok": True, "folders": mf, "documents": md, "root": root})
+    return _json_response({"ok": True, "folders": mf, "documents": md, "root": root})
 
 # --------- Tables ----------
 
 @app.post("/api/databases/<db_id>/tables")
+@with_pin_lock
 def create_table(db_id: str):
     pin = get_pin()
     if not pin:
@@ -849,14 +1410,17 @@ def create_table(db_id: str):
     db = dbs.get(db_id)
     if not db:
         abort(404)
-    name = request.json.get("name", "New Table").strip() or "New Table"
+    data = request.get_json(silent=True) or {}
+    name = data.get("name", "New Table").strip() or "New Table"
     t_id = gen_id()
     db.tables[t_id] = Table(id=t_id, name=name)
+    db.touch()
     save_state(pin, dbs)
-    return jsonify({"ok": True, "table": asdict(db.tables[t_id])})
+    return jsonify({"ok": True, "table": db.tables[t_id].to_dict()})
 
 
 @app.delete("/api/databases/<db_id>/tables/<t_id>")
+@with_pin_lock
 def delete_table(db_id: str, t_id: str):
     pin = get_pin()
     if not pin:
@@ -867,21 +1431,20 @@ def delete_table(db_id: str, t_id: str):
         abort(404)
     if t_id in db.tables:
         # remove links that reference this table or its columns
-        to_remove = [l_id for l_id, l in db.links.items() if (l.from_type == 'table' and l.from_id == t_id) or (l.to_type == 'table' and l.to_id == t_id)]
+        to_remove = db.links_for_table(t_id)
+        for c_id in db.tables[t_id].columns:
+            to_remove |= db.links_for_column(c_id)
         for l_id in to_remove:
-            db.links.pop(l_id, None)
-        # remove columns links
-        col_ids = list(db.tables[t_id].columns.keys())
-        to_remove2 = [l_id for l_id, l in db.links.items() if (l.from_type == 'column' and l.from_id in col_ids) or (l.to_type == 'column' and l.to_id in col_ids)]
-        for l_id in to_remove2:
-            db.links.pop(l_id, None)
+            db.remove_link(l_id)
         db.tables.pop(t_id)
+        db.touch()
         save_state(pin, dbs)
         return jsonify({"ok": True})
     abort(404)
 
 
 @app.patch("/api/databases/<db_id>/tables/<t_id>")
+@with_pin_lock
 def update_table(db_id: str, t_id: str):
     pin = get_pin()
     if not pin:
@@ -893,17 +1456,20 @@ def update_table(db_id: str, t_id: str):
     t = db.tables.get(t_id)
     if not t:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     if "name" in data:
         t.name = data["name"].strip() or t.name
+        t.slug = slugify(t.name)
     if "note" in data:
         t.note = data["note"]
+    db.touch()
     save_state(pin, dbs)
-    return jsonify({"ok": True, "table": asdict(t)})
+    return jsonify({"ok": True, "table": t.to_dict()})
 
 # --------- Columns ----------
 
 @app.post("/api/databases/<db_id>/tables/<t_id>/columns")
+@with_pin_lock
 def create_column(db_id: str, t_id: str):
     pin = get_pin()
     if not pin:
@@ -915,7 +1481,7 @@ def create_column(db_id: str, t_id: str):
     t = db.tables.get(t_id)
     if not t:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     name = (data.get("name") or "column").strip() or "column"
     c_id = gen_id()
     fr = None
@@ -928,14 +1494,6 @@ def create_column(db_id: str, t_id: str):
                 column_id=fr_raw["column_id"],
                 note=fr_raw.get("note", ""),
             )
-    # compute next order so newest appears at the bottom
-    next_order = 0
-    if t.columns:
-        try:
-            next_order = max((getattr(col, "order", 0) for col in t.columns.values()), default=-1) + 1
-        except Exception:
-            next_order = len(t.columns)
-
     col = Column(
         id=c_id,
         name=name,
@@ -945,14 +1503,16 @@ def create_column(db_id: str, t_id: str):
         default=data.get("default"),
         note=data.get("note", ""),
         foreign_ref=fr,
-        order=next_order,
+        order=t.next_order(),
     )
     t.columns[c_id] = col
+    db.touch()
     save_state(pin, dbs)
-    return jsonify({"ok": True, "column": asdict(col)})
+    return jsonify({"ok": True, "column": col.to_dict()})
 
 
 @app.delete("/api/databases/<db_id>/tables/<t_id>/columns/<c_id>")
+@with_pin_lock
 def delete_column(db_id: str, t_id: str, c_id: str):
     pin = get_pin()
     if not pin:
@@ -966,16 +1526,19 @@ def delete_column(db_id: str, t_id: str, c_id: str):
         abort(404)
     if c_id in t.columns:
         # remove links referencing this column
-        to_remove = [l_id for l_id, l in db.links.items() if (l.from_type == 'column' and l.from_id == c_id) or (l.to_type == 'column' and l.to_id == c_id)]
+        to_remove = list(db.links_for_column(c_id))
         for l_id in to_remove:
-            db.links.pop(l_id, None)
-        t.columns.pop(c_id)
-        save_state(pin, dbs)
+            db.remove_link(l_id)
+        if t.columns.pop(c_id).order == t._max_order:
+            t._max_order = None  # rescan on the next insert
+        db.touch()
+        append_delta(pin, {"op": "col.del", "db": db_id, "t": t_id, "c": c_id, "links": to_remove})
         return jsonify({"ok": True})
     abort(404)
 
 
 @app.patch("/api/databases/<db_id>/tables/<t_id>/columns/<c_id>")
+@with_pin_lock
 def update_column(db_id: str, t_id: str, c_id: str):
     pin = get_pin()
     if not pin:
@@ -990,9 +1553,10 @@ def update_column(db_id: str, t_id: str, c_id: str):
     col = t.columns.get(c_id)
     if not col:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     if "name" in data:
         col.name = data["name"].strip() or col.name
+        col.slug = slugify(col.name)
     if "datatype" in data:
         col.datatype = data["datatype"]
     if "is_primary" in data:
@@ -1017,14 +1581,18 @@ def update_column(db_id: str, t_id: str, c_id: str):
         try:
             new_order = int(data["order"])
             col.order = new_order
+            t._max_order = None
         except Exception:
             pass
-    save_state(pin, dbs)
-    return jsonify({"ok": True, "column": asdict(col)})
+    col_data = col.to_dict()
+    db.touch()
+    append_delta(pin, {"op": "col.upd", "db": db_id, "t": t_id, "col": col_data})
+    return _ack("column", col_data)
 
 # --------- Duplicate Database ----------
 
 @app.post("/api/databases/<db_id>/duplicate")
+@with_pin_lock
 def duplicate_database(db_id: str):
     pin = get_pin()
     if not pin:
@@ -1034,78 +1602,64 @@ def duplicate_database(db_id: str):
     if not src:
         abort(404)
 
+    # Draw every id the copy needs at once: database, tables, columns, links
+    ids = iter(gen_ids(1 + len(src.tables) + sum(len(t.columns) for t in src.tables.values()) + len(src.links)))
+
     # New database id and structure
-    new_db_id = gen_id()
+    new_db_id = next(ids)
     new_db = Database(id=new_db_id, name=f"{src.name} (copy)", note=src.note)
 
-    # Build id maps
-    table_id_map: Dict[str, str] = {}
-    col_id_map: Dict[str, str] = {}
+    # Build both id maps up front so foreign refs resolve while columns are built
+    table_id_map = {t_old_id: next(ids) for t_old_id in src.tables}
+    col_id_map = {c_old_id: next(ids) for t in src.tables.values() for c_old_id in t.columns}
+
+    def remap_ref(fr: Optional[ForeignRef]) -> Optional[ForeignRef]:
+        if fr is None:
+            return None
+        mapped_t = table_id_map.get(fr.table_id)
+        mapped_c = col_id_map.get(fr.column_id)
+        if mapped_t and mapped_c:
+            return ForeignRef(table_id=mapped_t, column_id=mapped_c, note=fr.note)
+        return None
 
-    # First pass: create tables and columns with new ids, but defer foreign_ref
-    pending_refs: List[tuple[str, str, ForeignRef]] = []  # (t_id_new, c_id_new, old_foreign_ref)
     for t_old_id, t in src.tables.items():
-        t_new_id = gen_id()
-        table_id_map[t_old_id] = t_new_id
-        new_table = Table(id=t_new_id, name=t.name, note=t.note)
-        new_db.tables[t_new_id] = new_table
-        for c_old_id, c in t.columns.items():
-            c_new_id = gen_id()
-            col_id_map[c_old_id] = c_new_id
-            new_col = Column(
-                id=c_new_id,
+        t_new_id = table_id_map[t_old_id]
+        new_db.tables[t_new_id] = Table(id=t_new_id, name=t.name, note=t.note, columns={
+            col_id_map[c_old_id]: Column(
+                id=col_id_map[c_old_id],
                 name=c.name,
                 datatype=c.datatype,
                 is_primary=c.is_primary,
                 is_nullable=c.is_nullable,
                 default=c.default,
                 note=c.note,
-                foreign_ref=None,
-            )
-            new_table.columns[c_new_id] = new_col
-            if c.foreign_ref:
-                pending_refs.append((t_new_id, c_new_id, c.foreign_ref))
-
-    # Resolve foreign refs
-    for t_new_id, c_new_id, fr in pending_refs:
-        mapped_t = table_id_map.get(fr.table_id)
-        mapped_c = col_id_map.get(fr.column_id)
-        if mapped_t and mapped_c:
-            new_db.tables[t_new_id].columns[c_new_id].foreign_ref = ForeignRef(
-                table_id=mapped_t,
-                column_id=mapped_c,
-                note=fr.note,
+                foreign_ref=remap_ref(c.foreign_ref),
             )
-
-    # Remap links too (if any exist)
-    for l_id, l in src.links.items():
-        new_l_id = gen_id()
-        from_id_new = l.from_id
-        to_id_new = l.to_id
-        if l.from_type == 'table':
-            from_id_new = table_id_map.get(l.from_id, l.from_id)
-        elif l.from_type == 'column':
-            from_id_new = col_id_map.get(l.from_id, l.from_id)
-        if l.to_type == 'table':
-            to_id_new = table_id_map.get(l.to_id, l.to_id)
-        elif l.to_type == 'column':
-            to_id_new = col_id_map.get(l.to_id, l.to_id)
-        new_db.links[new_l_id] = Link(
-            id=new_l_id,
+            for c_old_id, c in t.columns.items()
+        })
+
+    # Remap links too (if any exist); endpoints of other types keep their ids
+    id_maps = {'table': table_id_map, 'column': col_id_map}
+    no_map: Dict[str, str] = {}
+    for l in src.links.values():
+        new_db.add_link(Link(
+            id=next(ids),
             from_type=l.from_type,
-            from_id=from_id_new,
+            from_id=id_maps.get(l.from_type, no_map).get(l.from_id, l.from_id),
             to_type=l.to_type,
-            to_id=to_id_new,
+            to_id=id_maps.get(l.to_type, no_map).get(l.to_id, l.to_id),
             note=l.note,
-        )
+        ))
 
     dbs[new_db_id] = new_db
-    save_state(pin, dbs)
-    return jsonify({"ok": True, "database": asdict(new_db)})
+    db_data = new_db.to_dict()
+    append_delta(pin, {"op": "db.dup", "db": new_db_id, "data": db_data})
+    return _ack("database", db_data)
 
 # --------- Links ----------
 
 @app.post("/api/databases/<db_id>/links")
+@with_pin_lock
 def create_link(db_id: str):
     pin = get_pin()
     if not pin:
@@ -1114,7 +1668,7 @@ def create_link(db_id: str):
     db = dbs.get(db_id)
     if not db:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     link = Link(
         id=gen_id(),
         from_type=data.get("from_type", "table"),
@@ -1125,12 +1679,15 @@ def create_link(db_id: str):
     )
     if not link.from_id or not link.to_id:
         abort(400, "Missing link endpoints")
-    db.links[link.id] = link
-    save_state(pin, dbs)
-    return jsonify({"ok": True, "link": asdict(link)})
+    db.add_link(link)
+    link_data = link.to_dict()
+    db.touch()
+    append_delta(pin, {"op": "link.add", "db": db_id, "link": link_data})
+    return _ack("link", link_data)
 
 
 @app.patch("/api/databases/<db_id>/links/<l_id>")
+@with_pin_lock
 def update_link(db_id: str, l_id: str):
     pin = get_pin()
     if not pin:
@@ -1142,14 +1699,17 @@ def update_link(db_id: str, l_id: str):
     link = db.links.get(l_id)
     if not link:
         abort(404)
-    data = request.json or {}
+    data = request.get_json(silent=True) or {}
     if "note" in data:
         link.note = data["note"]
-    save_state(pin, dbs)
-    return jsonify({"ok": True, "link": asdict(link)})
+    link_data = link.to_dict()
+    db.touch()
+    append_delta(pin, {"op": "link.upd", "db": db_id, "link": link_data})
+    return _ack("link", link_data)
 
 
 @app.delete("/api/databases/<db_id>/links/<l_id>")
+@with_pin_lock
 def delete_link(db_id: str, l_id: str):
     pin = get_pin()
     if not pin:
@@ -1158,9 +1718,9 @@ def delete_link(db_id: str, l_id: str):
     db = dbs.get(db_id)
     if not db:
         abort(404)
-    if l_id in db.links:
-        db.links.pop(l_id)
-        save_state(pin, dbs)
+    if db.remove_link(l_id) is not None:
+        db.touch()
+        append_delta(pin, {"op": "link.del", "db": db_id, "l": l_id})
         return jsonify({"ok": True})
     abort(404)
 
@@ -1168,18 +1728,35 @@ def delete_link(db_id: str, l_id: str):
 # --------- Simple API to fetch state ----------
 
 @app.get("/api/state")
+@with_pin_lock
 def get_state():
     pin = get_pin()
     if not pin:
         abort(401)
     dbs = get_state_or_init(pin)
-    payload = {db_id: asdict(db) for db_id, db in dbs.items()}
-    return jsonify(payload)
+    with _CACHE_LOCK:
+        hit = _STATE_BODY.get(pin)
+        gen = _STATE_GEN.get(pin, 0)
+    # a reload from disk hands out a new dbs dict, which also misses here
+    if hit is not None and hit[0] is dbs:
+        _, etag, body = hit
+    else:
+        body = orjson.dumps({db_id: db.to_dict() for db_id, db in dbs.items()}, option=orjson.OPT_NON_STR_KEYS)
+        etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        with _CACHE_LOCK:
+            # store only for a PIN whose state is cached, i.e. one that exists
+            cached = _PIN_CACHE.get(pin)
+            if _STATE_GEN.get(pin, 0) == gen and cached is not None and cached[1][0] is dbs:
+                _STATE_BODY[pin] = (dbs, etag, body)
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
 
 
 # --------- Pages per database ----------
 
 @app.get("/db/<db_id>")
+@with_pin_lock
 def db_page(db_id: str):
     pin = get_pin()
     if not pin:
@@ -1188,7 +1765,12 @@ def db_page(db_id: str):
     db = dbs.get(db_id)
     if not db:
         abort(404)
-    return render_template("database.html", db=db, db_id=db_id)
+    etag = db.etag
+    if request.if_none_match.contains(etag):
+        return Response(status=304)
+    resp = make_response(render_template("database.html", db=db, db_id=db_id))
+    resp.set_etag(etag)
+    return resp
 
 
 # -----------------------------
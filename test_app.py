@@ -1,9 +1,38 @@
 import json
-from app import app
+import os
 
+import pytest
 
-def test_flow():
-    client = app.test_client()
+import app as app_module
+from app import app, load_state, pin_path, wal_path
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # each test gets its own data dir and cold caches; pending saves are
+    # flushed into it before it goes away
+    monkeypatch.setattr(app_module, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(app_module, "SHARES_PATH", str(tmp_path / "shares.json"))
+    _reset_caches()
+    yield app.test_client()
+    app_module._flush_all()
+    _reset_caches()
+
+
+def _reset_caches():
+    for timer in app_module._PENDING.values():
+        timer.cancel()
+    app_module._PENDING.clear()
+    app_module._PIN_CACHE.clear()
+    app_module._STATE_BODY.clear()
+    app_module._STATE_GEN.clear()
+    app_module._CHILDREN.clear()
+    app_module._CHILDREN_GEN.clear()
+    app_module._WAL_PINS.clear()
+    app_module._SHARES_CACHE = None
+
+
+def test_flow(client):
 
     # no pin -> unauthorized
     r = client.get('/api/state')
@@ -41,7 +70,12 @@ def test_flow():
         json={'from_type': 'column', 'from_id': c_id, 'to_type': 'table', 'to_id': t_id, 'note': 'fk-like'}
     )
     assert r.status_code == 200
-    l_id = r.json['link']['id']
+    l_id = r.json['id']
+    assert 'link' not in r.json
+
+    # the full object is only echoed on request
+    r = client.patch(f'/api/databases/{db_id}/links/{l_id}?echo=1', json={'note': 'fk'})
+    assert r.json['link']['note'] == 'fk' and r.json['link']['to_id'] == t_id
 
     # delete column
     r = client.delete(f'/api/databases/{db_id}/tables/{t_id}/columns/{c_id}')
@@ -60,8 +94,7 @@ def test_flow():
     assert r.json == {}
 
 
-def test_duplicate_and_foreign_ref():
-    client = app.test_client()
+def test_duplicate_and_foreign_ref(client):
     client.set_cookie('vibe_pin', 'pin2')
 
     # create db
@@ -86,7 +119,7 @@ def test_duplicate_and_foreign_ref():
     # duplicate db
     r = client.post(f'/api/databases/{db_id}/duplicate')
     assert r.status_code == 200
-    new_db_id = r.json['database']['id']
+    new_db_id = r.json['id']
     assert new_db_id != db_id
 
     # check that ref remapped
@@ -108,3 +141,335 @@ def test_duplicate_and_foreign_ref():
         if c['name'] == 'user_id': user_id_col = c
     assert user_id_col and user_id_col['foreign_ref']
     assert user_id_col['foreign_ref']['table_id'] == users_tid
+
+
+def test_state_cache_follows_file(client):
+    client.set_cookie('vibe_pin', 'cachepin')
+    path = pin_path('cachepin')
+    r = client.post('/api/databases', json={'name': 'Cached'})
+    db_id = r.json['database']['id']
+    # repeated loads reuse the parsed objects
+    assert load_state('cachepin') is load_state('cachepin')
+
+    # an edit made outside the app is picked up via the mtime check
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({db_id: {'id': db_id, 'name': 'Edited', 'tables': {}}}, f)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    r = client.get('/api/state')
+    assert r.json[db_id]['name'] == 'Edited'
+
+
+def test_doc_saves_are_coalesced(client):
+    client.set_cookie('vibe_pin', 'debouncepin')
+    path = pin_path('debouncepin')
+    r = client.post('/api/docs', json={'name': 'Draft', 'content': 'a'})
+    doc_id = r.json['document']['id']
+    for text in ('ab', 'abc', 'abcd'):
+        r = client.patch(f'/api/docs/{doc_id}', json={'content': text})
+        assert r.status_code == 200
+    # reads see the latest edit before it reaches disk
+    assert 'debouncepin' in app_module._PENDING
+    assert client.get(f'/api/docs/{doc_id}').json['document']['content'] == 'abcd'
+
+    app_module._flush_all()
+    assert 'debouncepin' not in app_module._PENDING
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['documents'][doc_id]['content'] == 'abcd'
+
+
+def test_schema_edits_go_through_delta_log(client):
+    client.set_cookie('vibe_pin', 'walpin')
+    path = pin_path('walpin')
+    db_id = client.post('/api/databases', json={'name': 'D'}).json['database']['id']
+    t_id = client.post(f'/api/databases/{db_id}/tables', json={'name': 'T'}).json['table']['id']
+    c_id = client.post(f'/api/databases/{db_id}/tables/{t_id}/columns', json={'name': 'a'}).json['column']['id']
+    for name in ('b', 'c'):
+        r = client.patch(f'/api/databases/{db_id}/tables/{t_id}/columns/{c_id}', json={'name': name})
+        assert r.status_code == 200
+    r = client.post(f'/api/databases/{db_id}/links', json={'from_type': 'table', 'from_id': t_id, 'to_type': 'column', 'to_id': c_id})
+    l_id = r.json['id']
+    r = client.post(f'/api/databases/{db_id}/duplicate')
+    copy_id = r.json['id']
+
+    # the snapshot is untouched; the edits live in the delta log
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)[db_id]['tables'][t_id]['columns'][c_id]['name'] == 'a'
+    assert os.path.exists(wal_path('walpin'))
+
+    # a cold load replays the log on top of the snapshot
+    app_module._PIN_CACHE.pop('walpin')
+    dbs = load_state('walpin')
+    assert dbs[db_id].tables[t_id].columns[c_id].name == 'c'
+    assert l_id in dbs[db_id].links
+    assert copy_id in dbs
+
+    # compaction folds the log into the snapshot
+    app_module._flush_all()
+    assert not os.path.exists(wal_path('walpin'))
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    assert raw[db_id]['tables'][t_id]['columns'][c_id]['name'] == 'c'
+    assert copy_id in raw
+
+
+def test_link_index_follows_deletes(client):
+    client.set_cookie('vibe_pin', 'idxpin')
+    db_id = client.post('/api/databases', json={'name': 'D'}).json['database']['id']
+    t1 = client.post(f'/api/databases/{db_id}/tables', json={'name': 'A'}).json['table']['id']
+    t2 = client.post(f'/api/databases/{db_id}/tables', json={'name': 'B'}).json['table']['id']
+    c1 = client.post(f'/api/databases/{db_id}/tables/{t1}/columns', json={'name': 'x'}).json['column']['id']
+    c2 = client.post(f'/api/databases/{db_id}/tables/{t2}/columns', json={'name': 'y'}).json['column']['id']
+    base = f'/api/databases/{db_id}/links'
+    col_link = client.post(base, json={'from_type': 'column', 'from_id': c1, 'to_type': 'column', 'to_id': c2}).json['id']
+    tbl_link = client.post(base, json={'from_type': 'table', 'from_id': t1, 'to_type': 'table', 'to_id': t2}).json['id']
+    keep = client.post(base, json={'from_type': 'table', 'from_id': t1, 'to_type': 'column', 'to_id': c1}).json['id']
+    assert load_state('idxpin')[db_id].links_for_column(c2) == {col_link}
+
+    assert client.delete(f'/api/databases/{db_id}/tables/{t2}/columns/{c2}').status_code == 200
+    db = load_state('idxpin')[db_id]
+    assert set(db.links) == {tbl_link, keep}
+    assert db.links_for_column(c2) == set()
+
+    assert client.delete(f'/api/databases/{db_id}/tables/{t1}').status_code == 200
+    assert db.links == {} and db._links_by_col == {} and db._links_by_table == {}
+
+
+def test_state_body_is_cached_with_etag(client):
+    client.set_cookie('vibe_pin', 'etagpin')
+    db_id = client.post('/api/databases', json={'name': 'D'}).json['database']['id']
+    r1 = client.get('/api/state')
+    etag = r1.headers['ETag']
+    assert db_id in r1.json
+    r2 = client.get('/api/state', headers={'If-None-Match': etag})
+    assert r2.status_code == 304
+
+    # an edit through the delta log invalidates the cached body
+    t_id = client.post(f'/api/databases/{db_id}/tables', json={'name': 'T'}).json['table']['id']
+    c_id = client.post(f'/api/databases/{db_id}/tables/{t_id}/columns', json={'name': 'a'}).json['column']['id']
+    client.patch(f'/api/databases/{db_id}/tables/{t_id}/columns/{c_id}', json={'name': 'b'})
+    r3 = client.get('/api/state', headers={'If-None-Match': etag})
+    assert r3.status_code == 200 and r3.headers['ETag'] != etag
+    assert r3.json[db_id]['tables'][t_id]['columns'][c_id]['name'] == 'b'
+
+
+def test_new_columns_go_to_the_bottom(client):
+    client.set_cookie('vibe_pin', 'orderpin')
+    db_id = client.post('/api/databases', json={'name': 'D'}).json['database']['id']
+    t_id = client.post(f'/api/databases/{db_id}/tables', json={'name': 'T'}).json['table']['id']
+    base = f'/api/databases/{db_id}/tables/{t_id}/columns'
+    orders = [client.post(base, json={'name': n}).json['column']['order'] for n in 'abc']
+    assert orders == [0, 1, 2]
+    last = client.post(base, json={'name': 'd'}).json['column']
+    client.delete(f"{base}/{last['id']}")
+    assert client.post(base, json={'name': 'e'}).json['column']['order'] == 3
+    first = client.get('/api/state').json[db_id]['tables'][t_id]['columns']
+    a_id = next(c_id for c_id, c in first.items() if c['name'] == 'a')
+    client.patch(f'{base}/{a_id}', json={'order': 10})
+    assert client.post(base, json={'name': 'f'}).json['column']['order'] == 11
+
+
+def test_create_without_body_uses_defaults(client):
+    client.set_cookie('vibe_pin', 'nobodypin')
+    r = client.post('/api/databases')
+    assert r.status_code == 200 and r.json['database']['name'] == 'New Database'
+    db_id = r.json['database']['id']
+    r = client.post(f'/api/databases/{db_id}/tables', data='not json', content_type='application/json')
+    assert r.status_code == 200 and r.json['table']['name'] == 'New Table'
+
+
+def test_db_page_etag_follows_edits(client):
+    client.set_cookie('vibe_pin', 'pagepin')
+    db_id = client.post('/api/databases', json={'name': 'D'}).json['database']['id']
+    r = client.get(f'/db/{db_id}')
+    etag = r.headers['ETag']
+    assert r.status_code == 200
+    assert client.get(f'/db/{db_id}', headers={'If-None-Match': etag}).status_code == 304
+
+    client.patch(f'/api/databases/{db_id}', json={'name': 'Renamed'})
+    r = client.get(f'/db/{db_id}', headers={'If-None-Match': etag})
+    assert r.status_code == 200 and b'Renamed' in r.data
+    assert r.headers['ETag'] != etag
+
+
+def test_doc_page_ships_only_persisted_fields(client):
+    client.set_cookie('vibe_pin', 'docpagepin')
+    doc_id = client.post('/api/docs', json={'name': 'Page', 'content': '# Title\nbody'}).json['document']['id']
+    r = client.get(f'/docs/d/{doc_id}')
+    assert r.status_code == 200
+    assert b'"content_lower"' not in r.data and b'"headings"' not in r.data
+    assert b'"content":"# Title\\nbody"' in r.data
+
+
+def test_failed_write_leaves_no_temp_file(tmp_path, monkeypatch):
+    def fail(src, dst):
+        raise OSError('replace failed')
+    monkeypatch.setattr(app_module.os, 'replace', fail)
+    with pytest.raises(OSError):
+        app_module._atomic_write_bytes(str(tmp_path / 'x.json'), b'{}')
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_flush_waits_for_the_pin_lock(client):
+    import threading
+    client.set_cookie('vibe_pin', 'lockpin')
+    client.post('/api/docs', json={'name': 'Draft', 'content': 'a'})
+    assert 'lockpin' in app_module._PENDING
+    with app_module._pin_lock('lockpin'):
+        flusher = threading.Thread(target=app_module._flush, args=('lockpin',))
+        flusher.start()
+        flusher.join(0.1)
+        # the flush cannot serialize the docs while a handler holds the PIN
+        assert flusher.is_alive() and not os.path.exists(pin_path('lockpin'))
+    flusher.join()
+    assert os.path.exists(pin_path('lockpin'))
+
+
+def test_children_index_built_across_a_save_is_not_cached(client, monkeypatch):
+    client.set_cookie('vibe_pin', 'kidspin')
+    client.post('/api/docs/folders', json={'name': 'F'})
+    real_load_docs = app_module.load_docs
+
+    def load_then_save(pin):
+        folders, documents = real_load_docs(pin)
+        # another request saves while this one is still building the index
+        app_module.save_docs(pin, folders, documents)
+        return folders, documents
+
+    monkeypatch.setattr(app_module, 'load_docs', load_then_save)
+    app_module.load_children('kidspin')
+    assert 'kidspin' not in app_module._CHILDREN
+    monkeypatch.setattr(app_module, 'load_docs', real_load_docs)
+    app_module.load_children('kidspin')
+    assert 'kidspin' in app_module._CHILDREN
+
+
+def test_unknown_pins_leave_no_cache_entries(client):
+    import gc
+    for pin in ('ghost1', 'ghost2'):
+        client.set_cookie('vibe_pin', pin)
+        assert client.get('/api/state').json == {}
+        assert client.get('/api/state').status_code == 200
+    gc.collect()
+    for cache in (app_module._PIN_CACHE, app_module._STATE_BODY, app_module._PIN_LOCKS):
+        assert 'ghost1' not in cache and 'ghost2' not in cache
+
+
+def test_readers_do_not_race_writers(client):
+    import sys
+    import threading
+    client.set_cookie('vibe_pin', 'racepin')
+    for i in range(300):
+        client.post('/api/docs', json={'name': f'seed{i}'})
+    statuses = []
+    done = threading.Event()
+
+    def read():
+        reader = app.test_client()
+        reader.set_cookie('vibe_pin', 'racepin')
+        while not done.is_set():
+            statuses.append(reader.get('/api/docs/state').status_code)
+
+    # switch threads often so a reader is caught mid-iteration
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    try:
+        for t in readers:
+            t.start()
+        for i in range(200):
+            client.post('/api/docs', json={'name': f'd{i}'})
+    finally:
+        done.set()
+        for t in readers:
+            t.join()
+        sys.setswitchinterval(old_interval)
+    assert statuses and set(statuses) == {200}
+
+
+def test_cold_load_keeps_objects_stored_meanwhile(client, monkeypatch):
+    client.set_cookie('vibe_pin', 'racewal')
+    db_id = client.post('/api/databases', json={'name': 'D'}).json['database']['id']
+    app_module._PIN_CACHE.clear()
+    winner = app_module.load_all('racewal')
+    app_module._PIN_CACHE.clear()
+    real_build = app_module._build_dbs
+
+    def build_while_another_request_loads(raw):
+        # a second request finishes its own cold load mid-parse
+        app_module._PIN_CACHE['racewal'] = (0, winner)
+        return real_build(raw)
+
+    monkeypatch.setattr(app_module, '_build_dbs', build_while_another_request_loads)
+    assert app_module.load_all('racewal') is winner
+    assert app_module._PIN_CACHE['racewal'][1] is winner
+    assert db_id in winner[0]
+
+
+def test_atomic_write_does_not_need_fchmod(tmp_path, monkeypatch):
+    # Windows has no os.fchmod before Python 3.13
+    monkeypatch.delattr(app_module.os, 'fchmod', raising=False)
+    target = tmp_path / 'x.json'
+    app_module._atomic_write_bytes(str(target), b'{}')
+    assert target.read_bytes() == b'{}'
+    assert [p.name for p in tmp_path.iterdir()] == ['x.json']
+
+
+def test_concurrent_shares_are_all_kept(client):
+    import threading
+    tokens = []
+
+    def share(pin):
+        c = app.test_client()
+        c.set_cookie('vibe_pin', pin)
+        doc_id = c.post('/api/docs', json={'name': 'Shared'}).json['document']['id']
+        for _ in range(10):
+            tokens.append(c.post(f'/api/docs/{doc_id}/share').json['token'])
+
+    threads = [threading.Thread(target=share, args=(f'sharepin{i}',)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(tokens) == 40
+    app_module._SHARES_CACHE = None
+    assert set(app_module.load_shares()) == set(tokens)
+
+
+def test_bad_doc_and_folder_updates_change_nothing(client):
+    client.set_cookie('vibe_pin', 'validpin')
+    fid = client.post('/api/docs/folders', json={'name': 'F'}).json['folder']['id']
+    other = client.post('/api/docs/folders', json={'name': 'G'}).json['folder']['id']
+    doc_id = client.post('/api/docs', json={'name': 'D', 'content': 'x'}).json['document']['id']
+    for body in ({'parent_id': fid, 'name': 5}, {'parent_id': fid, 'content': ['x']}, {'parent_id': ['x']}):
+        assert client.patch(f'/api/docs/{doc_id}', json=body).status_code == 400
+    assert client.patch(f'/api/docs/folders/{other}', json={'parent_id': fid, 'name': 5}).status_code == 400
+    state = client.get('/api/docs/state').json
+    assert state['documents'][doc_id]['parent_id'] is None and state['documents'][doc_id]['name'] == 'D'
+    assert state['folders'][other]['parent_id'] is None
+
+
+def test_search_finds_docs_headings_and_schema(client):
+    client.set_cookie('vibe_pin', 'searchpin')
+    doc_id = client.post('/api/docs', json={'name': 'Guide', 'content': 'intro orbit\n# Setup Steps\nx\r# after-cr\r## \n'}).json['document']['id']
+    db_id = client.post('/api/databases', json={'name': 'Sales Data'}).json['database']['id']
+    t_id = client.post(f'/api/databases/{db_id}/tables', json={'name': 'Orders'}).json['table']['id']
+    c_id = client.post(f'/api/databases/{db_id}/tables/{t_id}/columns', json={'name': 'Order Total'}).json['column']['id']
+
+    def search(q):
+        return client.get('/api/search', query_string={'q': q}).json['results']
+
+    assert search('orbit') == [{'type': 'doc', 'id': doc_id, 'name': 'Guide', 'parent_id': None}]
+    headings = [r['heading'] for r in search('') if r['type'] == 'heading']
+    assert headings == ['Setup Steps', 'after-cr']
+    assert [r['type'] for r in search('SETUP')] == ['doc', 'heading']
+    assert search('after-cr')[1:] == [{'type': 'heading', 'doc_id': doc_id, 'heading': 'after-cr', 'doc_name': 'Guide', 'parent_id': None}]
+    assert search('sales-d') == [{'type': 'database', 'db_id': db_id, 'name': 'Sales Data', 'slug': 'sales-data'}]
+    table_hits = [r for r in search('orders') if r['type'] == 'table']
+    assert table_hits == [{'type': 'table', 'db_id': db_id, 'table_id': t_id, 'name': 'Orders', 'slug': 'orders'}]
+    assert search('orders.order-total') == [{'type': 'column', 'db_id': db_id, 'table_id': t_id, 'column_id': c_id,
+                                             'name': 'Order Total', 'slug': 'order-total', 'label': 'orders.order-total'}]
+
+    # renames are searchable right away
+    client.patch(f'/api/databases/{db_id}/tables/{t_id}', json={'name': 'Invoices'})
+    assert [r['type'] for r in search('invoices')] == ['table', 'column']